@@ -1,84 +1,18 @@
 import streamlit as st
-import base64
-from openai import OpenAI
+import hashlib
+import io
+from collections import OrderedDict
 import os
-from dotenv import load_dotenv
+import time
+import threading
+import asyncio
+from functools import partial
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 
-# Load environment variables from .env file (local development) or environment (cloud)
-load_dotenv()  # will load from .env if present, no error if not found
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    st.error("""
-    No OpenAI API key found. Please set up your API key:
-    - Local development: Add OPENAI_API_KEY to your .env file
-    - Streamlit Cloud: Add OPENAI_API_KEY in the app settings under Secrets
-    """)
-    st.stop()
-
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key)
-
-def process_image(image_file, supplies, setting, expertise, willingness, frequency, infected, moisture):
-    # Convert image to base64
-    image_bytes = image_file.getvalue()
-    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    
-    # Construct prompt
-    prompt = f"""
-    You are an educational AI assistant helping to identify visual features in wound images
-    for research and model development.
-
-    Your goal is to generate a step-by-step treatment plan **based on both the text context and the visible landmarks in the image.**
-
-    User-provided context:
-    - Supplies available: {supplies}
-    - Setting: {setting}
-    - Expertise-level: {expertise}
-    - Willing to visit hospital: {willingness}
-    - Frequency of clinic visits: {frequency}
-    - Wound infection status: {infected}
-    - Wound moisture: {moisture}
-
-    ### Instructions ###
-    1. Carefully examine **visual landmarkers** in the wound image — e.g., color changes, necrotic tissue, swelling, drainage, redness, or exposed structures.
-    2. Incorporate those landmarks explicitly into the treatment plan (e.g., "Clean around the dark necrotic edge" or "Protect the red granulating area with Xeroform").
-    3. Use only supplies the user has available. Do not use supplies if its excessive for the severity of the wound.
-    4. Do not use em dashes (—), en dashes (–), or hyphens (-) for separating phrases; instead use commas or semicolons.
-    5. Carefully consider the expertise-level when choosing the language for the instructions
-    6. Keep your output as a **numbered list** (1., 2., 3., etc.) with concise, actionable wound-care steps.
-    7. Place spaces between each step for readability.
-    8. Before each step, put a summary statement (bold and slightly larger font) of that step so a user can quickly scan the plan.
-    9. Only list the steps do not add any additional commentary or explanation outside of the numbered steps.
-
-
-    """
-
-    # Prepare API request
-    messages = [
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{image_b64}"
-                    }
-                }
-            ]
-        }
-    ]
-
-    try:
-        # Call GPT-4 Vision API
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=messages,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"⚠️ Error calling OpenAI API: {e}"
+# Backward compatibility: Streamlit < 1.27 uses experimental_rerun. Resolved once
+# here instead of checking hasattr at every call site
+rerun = getattr(st, "rerun", None) or st.experimental_rerun
 
 # Set up the Streamlit page
 st.set_page_config(page_title="Wound Care Assessment", layout="wide")
@@ -87,53 +21,47 @@ st.set_page_config(page_title="Wound Care Assessment", layout="wide")
 if 'terms_accepted' not in st.session_state:
     st.session_state.terms_accepted = False
 
-# Initialize session state for page navigation
-if 'current_page' not in st.session_state:
-    st.session_state.current_page = "input"  # "input" or "results"
-if 'assessment_data' not in st.session_state:
-    st.session_state.assessment_data = None
+TERMS_HEADER_MD = """
+# Terms and Conditions of Use
+### Effective Date: October 24, 2025
+
+
+This AI wound-care tool is for research and educational purposes only.
+It must not be used for medical diagnosis, treatment, or patient care — including at home.
+"""
+
+TERMS_BODY_MD = """
+### 1. Acceptance of Terms
+By accessing or using this wound care AI tool ("the Tool"), you agree to be bound by these Terms and Conditions of Use ("Terms"). If you do not agree to these Terms, you may not access or use the Tool.
+
+### 2. Purpose of the Tool
+This Tool is provided exclusively for research, educational, and informational purposes. It is a demonstration of artificial-intelligence models applied to wound-care scenarios. The Tool is not intended or approved for use in any medical, clinical, or home-care setting.
+
+### 3. No Medical Advice
+The Tool does not provide medical advice and must not be used to diagnose, treat, or manage any health condition. Do not rely on any output of the Tool to make healthcare or personal medical decisions. Use of the Tool for any clinical or home-care purpose is strictly prohibited.
+
+### 4. User Obligations
+- Use it only for research, education, or personal curiosity, not for patient care.
+- Do not upload identifiable patient or personal health information.
+- Do not redistribute outputs as medical guidance.
+- Comply with all laws and ethical research standards.
+
+### 5. No Warranty
+The Tool is provided "as is" and "as available" without any warranty or guarantee of accuracy, reliability, or fitness for purpose. Outputs may be incomplete or inconsistent.
+"""
 
 def show_terms():
-    st.markdown("""
-    # Terms and Conditions of Use
-    ### Effective Date: October 24, 2025
-    
-    
-    This AI wound-care tool is for research and educational purposes only. 
-    It must not be used for medical diagnosis, treatment, or patient care — including at home.
-    """)
+    st.markdown(TERMS_HEADER_MD)
     
     with st.expander("Click to Read Full Terms", expanded=True):
-        st.markdown("""
-        ### 1. Acceptance of Terms
-        By accessing or using this wound care AI tool ("the Tool"), you agree to be bound by these Terms and Conditions of Use ("Terms"). If you do not agree to these Terms, you may not access or use the Tool.
-        
-        ### 2. Purpose of the Tool
-        This Tool is provided exclusively for research, educational, and informational purposes. It is a demonstration of artificial-intelligence models applied to wound-care scenarios. The Tool is not intended or approved for use in any medical, clinical, or home-care setting.
-        
-        ### 3. No Medical Advice
-        The Tool does not provide medical advice and must not be used to diagnose, treat, or manage any health condition. Do not rely on any output of the Tool to make healthcare or personal medical decisions. Use of the Tool for any clinical or home-care purpose is strictly prohibited.
-        
-        ### 4. User Obligations
-        - Use it only for research, education, or personal curiosity, not for patient care.
-        - Do not upload identifiable patient or personal health information.
-        - Do not redistribute outputs as medical guidance.
-        - Comply with all laws and ethical research standards.
-        
-        ### 5. No Warranty
-        The Tool is provided "as is" and "as available" without any warranty or guarantee of accuracy, reliability, or fitness for purpose. Outputs may be incomplete or inconsistent.
-        """)
+        st.markdown(TERMS_BODY_MD)
     
     st.markdown("---")
     col1, col2 = st.columns([1, 1])
     with col1:
         if st.button("I Accept These Terms", use_container_width=True, type="primary"):
             st.session_state.terms_accepted = True
-            # Backward compatibility: Streamlit < 1.27 uses experimental_rerun
-            if hasattr(st, "rerun"):
-                st.rerun()
-            else:
-                st.experimental_rerun()
+            rerun()
     with col2:
         if st.button("Decline", use_container_width=True, type="secondary"):
             st.error("You must accept the terms to use this application.")
@@ -141,7 +69,8 @@ def show_terms():
     
     st.markdown("---")
 
-# Show terms if not accepted
+# Show terms if not accepted; this runs before the API client and the rest of
+# the app are set up so reruns of the terms screen stay cheap
 if not st.session_state.terms_accepted:
     show_terms()
     st.stop()
@@ -153,11 +82,584 @@ else:
         </script>
     """, height=0)
 
-# Show terms if not accepted
-if not st.session_state.terms_accepted:
-    show_terms()
+# Heavy imports are deferred until the terms are accepted so terms-screen reruns
+# don't pay for loading openai (httpx, pydantic), Pillow or pybase64
+import pybase64
+from PIL import Image, ImageOps
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+# Load environment variables from .env file (local development) or environment (cloud).
+# This runs once per process rather than on every rerun; on Streamlit Cloud there
+# is no .env, so skip importing dotenv. The .env next to app.py is used, since
+# streamlit run does not change into the script's directory
+@st.cache_resource
+def load_env():
+    env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+    if os.path.exists(env_path):
+        from dotenv import load_dotenv
+        load_dotenv(env_path)
+
+load_env()
+# The key itself is read on every rerun so a missing key is reported each time
+api_key = os.getenv("OPENAI_API_KEY")
+if not api_key:
+    st.error("""
+    No OpenAI API key found. Please set up your API key:
+    - Local development: Add OPENAI_API_KEY to your .env file
+    - Streamlit Cloud: Add OPENAI_API_KEY in the app settings under Secrets
+    """)
     st.stop()
 
+# Give up on a stalled API call after this many seconds. The SDK retries
+# connection errors, 408/409/429 and 5xx responses with exponential backoff
+API_TIMEOUT = 30
+API_MAX_RETRIES = 2
+
+# Initialize OpenAI client once per process so reruns and follow-ups reuse a
+# warm HTTP/2 connection pool instead of opening a new TLS session
+@st.cache_resource
+def get_client(api_key):
+    http_client = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=8))
+    return OpenAI(api_key=api_key, http_client=http_client, timeout=API_TIMEOUT, max_retries=API_MAX_RETRIES)
+
+client = get_client(api_key)
+
+# Output token caps; a wound care plan is usually well under 400 tokens
+ASSESSMENT_MAX_OUTPUT_TOKENS = 600
+FOLLOWUP_MAX_TOKENS = 500
+
+# Static assessment instructions, sent verbatim as the system message so the
+# request prefix is byte-identical across calls and can be served from OpenAI's
+# prompt cache
+SYSTEM_PROMPT = """You are an educational AI assistant helping to identify visual features in wound images
+for research and model development.
+
+Your goal is to generate a step-by-step treatment plan **based on both the text context and the visible landmarks in the image.**
+
+### Instructions ###
+1. Carefully examine **visual landmarkers** in the wound image — e.g., color changes, necrotic tissue, swelling, drainage, redness, or exposed structures.
+2. Incorporate those landmarks explicitly into the treatment plan (e.g., "Clean around the dark necrotic edge" or "Protect the red granulating area with Xeroform").
+3. Use only supplies the user has available. Do not use supplies if its excessive for the severity of the wound.
+4. Do not use em dashes (—), en dashes (–), or hyphens (-) for separating phrases; instead use commas or semicolons.
+5. Carefully consider the expertise-level when choosing the language for the instructions
+6. Keep your output as a **numbered list** (1., 2., 3., etc.) with concise, actionable wound-care steps.
+7. Place spaces between each step for readability.
+8. Before each step, put a summary statement (bold and slightly larger font) of that step so a user can quickly scan the plan.
+9. Only list the steps do not add any additional commentary or explanation outside of the numbered steps.
+"""
+
+# Per-request user message; only this part is formatted on each call
+CONTEXT_TEMPLATE = """User-provided context:
+- Supplies available: {supplies}
+- Setting: {setting}
+- Expertise-level: {expertise}
+- Willing to visit hospital: {willingness}
+- Frequency of clinic visits: {frequency}
+- Wound infection status: {infected}
+- Wound moisture: {moisture}
+"""
+
+# Vision detail level; "low" uses the fixed low-resolution tokenizer path,
+# set to "high" to let the model tile the full 1024px image
+IMAGE_DETAIL = "low"
+
+# Largest accepted upload. Everything above this is rejected outright; below it
+# compress_image brings large photos down to a 1024px JPEG before sending
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+# Images up to this size are inlined as a data URL; the extra upload round trip
+# only pays off once the base64 payload gets large
+INLINE_IMAGE_MAX_BYTES = 200_000
+
+# Uploaded images expire from OpenAI file storage after an hour (the shortest
+# allowed), even if the session ends without Finish deleting them
+UPLOADED_IMAGE_TTL = 3600
+
+# A cached file id is only reused while the file has at least ten minutes left,
+# so a request never references a file that expires before it is read
+UPLOADED_IMAGE_REUSE_SECONDS = UPLOADED_IMAGE_TTL - 600
+
+# Data URL prefixes per MIME type, so building a URL is a single str concatenation
+DATA_URL_PREFIXES = {
+    "image/jpeg": "data:image/jpeg;base64,",
+    "image/png": "data:image/png;base64,",
+}
+
+# Several images are assessed in a single request, up to this many; each gets
+# its own output token budget
+IMAGES_PER_REQUEST = 4
+
+# Appended to the user context when one request carries several images
+MULTI_IMAGE_TEMPLATE = """
+There are {count} wound images, labelled Image 1 to Image {count} in upload order.
+Assess each image separately under its own "### Image N" heading, following the instructions for each one.
+"""
+
+# Maximum number of images assessed concurrently when a batch is split up
+BATCH_MAX_CONCURRENCY = 5
+
+# Finished responses are reused for an hour, for at most this many distinct requests
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 128
+
+def image_mime_type(image_bytes):
+    # Sniff the format from magic bytes; the uploader only accepts JPEG and PNG
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    return "image/jpeg"
+
+def image_digest(image_bytes):
+    # blake2b runs well above base64 speed, so hashing first is cheap
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+def upload_image(image_bytes, digest):
+    # Upload each distinct image once per session and reuse its file id on reruns,
+    # uploading again once the file is close to expiring
+    file_ids = st.session_state.setdefault("uploaded_file_ids", {})
+    entry = file_ids.get(digest)
+    if entry is None or time.monotonic() - entry[1] > UPLOADED_IMAGE_REUSE_SECONDS:
+        filename = "wound.png" if image_mime_type(image_bytes) == "image/png" else "wound.jpg"
+        uploaded = client.files.create(
+            file=(filename, image_bytes),
+            purpose="vision",
+            expires_after={"anchor": "created_at", "seconds": UPLOADED_IMAGE_TTL}
+        )
+        entry = file_ids[digest] = (uploaded.id, time.monotonic())
+    return entry[0]
+
+def delete_uploaded_images():
+    # Remove this session's uploads from OpenAI file storage once the conversation
+    # is over; this is best effort since the files expire on their own anyway
+    file_ids = st.session_state.get("uploaded_file_ids", {})
+    for file_id, _ in file_ids.values():
+        try:
+            client.files.delete(file_id)
+        except Exception:
+            pass
+    file_ids.clear()
+
+def image_data_url(image_bytes, digest):
+    # Encode each distinct image once per session and reuse the data URL on resubmits;
+    # only the last few images are kept since each entry is a multi-MB string
+    data_urls = st.session_state.setdefault("image_data_urls", OrderedDict())
+    if digest in data_urls:
+        data_urls.move_to_end(digest)
+    else:
+        data_urls[digest] = DATA_URL_PREFIXES[image_mime_type(image_bytes)] + pybase64.b64encode_as_string(image_bytes)
+        while len(data_urls) > 4:
+            data_urls.popitem(last=False)
+    return data_urls[digest]
+
+def compress_image(image_bytes):
+    # Small uploads are sent as-is; larger ones are downscaled to the model's
+    # 1024px tile size and re-encoded as JPEG to shrink the payload
+    if len(image_bytes) < 200_000:
+        return image_bytes
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=80, optimize=True, progressive=True)
+    return buf.getvalue()
+
+@st.cache_resource
+def get_preprocess_executor():
+    # Background workers for image preprocessing, shared by all sessions; Pillow
+    # releases the GIL while resizing and encoding, so this overlaps with the
+    # script threads, and several workers keep one user's batch from queueing
+    # behind another's
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+def upload_file_id(uploaded_file):
+    # Backward compatibility: UploadedFile.file_id was named id before Streamlit 1.26
+    return getattr(uploaded_file, "file_id", None) or uploaded_file.id
+
+def uploaded_image_bytes(uploaded_file):
+    # Copy each upload's bytes out of the UploadedFile once and reuse them for
+    # preprocessing and on submit. Entries live as long as the file stays in the
+    # uploader, see forget_removed_uploads
+    uploads = st.session_state.setdefault("uploaded_image_bytes", {})
+    file_id = upload_file_id(uploaded_file)
+    if file_id not in uploads:
+        uploads[file_id] = uploaded_file.getvalue()
+    return uploads[file_id]
+
+def start_preprocessing(uploaded_file):
+    # Start downscaling a new upload in the background while the form is filled in,
+    # so the work is usually finished by the time Generate Assessment is clicked.
+    # Started uploads map file id to digest so removed files can be cleaned up
+    started = st.session_state.setdefault("preprocessed_file_ids", {})
+    file_id = upload_file_id(uploaded_file)
+    if file_id in started:
+        return
+    image_bytes = uploaded_image_bytes(uploaded_file)
+    digest = started[file_id] = image_digest(image_bytes)
+    futures = st.session_state.setdefault("preprocessed_images", {})
+    if digest not in futures:
+        futures[digest] = get_preprocess_executor().submit(compress_image, image_bytes)
+
+def forget_removed_uploads(uploaded_files):
+    # Drop the bytes and preprocessing of files no longer in the uploader, so the
+    # caches track the current uploads however many there are. Work not yet
+    # started for a removed file is cancelled
+    current = {upload_file_id(uploaded_file) for uploaded_file in uploaded_files}
+    uploads = st.session_state.get("uploaded_image_bytes", {})
+    started = st.session_state.get("preprocessed_file_ids", {})
+    futures = st.session_state.get("preprocessed_images", {})
+    for file_id in [file_id for file_id in uploads if file_id not in current]:
+        del uploads[file_id]
+    for file_id in [file_id for file_id in started if file_id not in current]:
+        del started[file_id]
+    for digest in [digest for digest in futures if digest not in started.values()]:
+        futures.pop(digest).cancel()
+
+def preprocessed_image(image_bytes):
+    # Use the background result when one was started for these bytes, otherwise compress now
+    future = st.session_state.get("preprocessed_images", {}).get(image_digest(image_bytes))
+    if future is None:
+        return compress_image(image_bytes)
+    return future.result()
+
+@st.cache_resource
+def get_response_cache():
+    # Finished model responses shared across sessions. A plain LRU dict with a TTL
+    # is used because st.cache_data cannot wrap a streaming generator
+    return OrderedDict()
+
+@st.cache_resource
+def get_response_cache_lock():
+    # Every session's script thread shares the cache, so each read and write
+    # holds this lock
+    return threading.Lock()
+
+def cached_response(key):
+    cache = get_response_cache()
+    with get_response_cache_lock():
+        entry = cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > RESPONSE_CACHE_TTL:
+            return None
+        cache.move_to_end(key)
+        return entry[1]
+
+def cache_response(key, text):
+    cache = get_response_cache()
+    with get_response_cache_lock():
+        cache[key] = (time.monotonic(), text)
+        cache.move_to_end(key)
+        while len(cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+def image_input_part(image_bytes):
+    image_bytes = preprocessed_image(image_bytes)
+    digest = image_digest(image_bytes)
+    image_part = None
+    if len(image_bytes) > INLINE_IMAGE_MAX_BYTES:
+        try:
+            # Reference the image by file id instead of inlining it as base64
+            image_part = {"type": "input_image", "file_id": upload_image(image_bytes, digest), "detail": IMAGE_DETAIL}
+        except Exception:
+            # Fall back to an inline data URL if the Files endpoint is unavailable
+            pass
+    if image_part is None:
+        image_part = {"type": "input_image", "image_url": image_data_url(image_bytes, digest), "detail": IMAGE_DETAIL}
+    return image_part
+
+def build_assessment_input(images, supplies, setting, expertise, willingness, frequency, infected, moisture):
+    # Construct prompt
+    context = CONTEXT_TEMPLATE.format(
+        supplies=supplies,
+        setting=setting,
+        expertise=expertise,
+        willingness=willingness,
+        frequency=frequency,
+        infected=infected,
+        moisture=moisture
+    )
+
+    if len(images) == 1:
+        content = [{"type": "input_text", "text": context}, image_input_part(images[0])]
+    else:
+        # Several images share one request; label them so each is assessed separately
+        content = [{"type": "input_text", "text": context + MULTI_IMAGE_TEMPLATE.format(count=len(images))}]
+        for i, image_bytes in enumerate(images, 1):
+            content.append({"type": "input_text", "text": f"Image {i}:"})
+            content.append(image_input_part(image_bytes))
+
+    # Prepare API request
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content}
+    ]
+
+def check_response(response):
+    # The Responses API reports refusals, failures and truncation inside the
+    # response instead of raising, so turn them into errors before anything is
+    # shown as an assessment or cached
+    for item in response.output:
+        for part in getattr(item, "content", None) or []:
+            if part.type == "refusal":
+                raise RuntimeError(f"The model declined to assess the image: {part.refusal}")
+    if response.status == "failed":
+        raise RuntimeError(response.error.message if response.error else "The assessment request failed")
+    if response.status == "incomplete":
+        reason = response.incomplete_details.reason if response.incomplete_details else "unknown reason"
+        raise RuntimeError(f"The assessment was cut off ({reason})")
+    if not response.output_text:
+        raise RuntimeError("The model returned an empty assessment")
+    return response.output_text
+
+def process_image(images, supplies, setting, expertise, willingness, frequency, infected, moisture):
+    messages = build_assessment_input(images, supplies, setting, expertise, willingness, frequency, infected, moisture)
+
+    # Call GPT-4 Vision API (the Responses API accepts uploaded file ids for images)
+    # and yield the text as it is generated
+    response = client.responses.create(
+        model="gpt-4.1",
+        input=messages,
+        max_output_tokens=ASSESSMENT_MAX_OUTPUT_TOKENS * len(images),
+        stream=True
+    )
+    for event in response:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "error":
+            raise RuntimeError(event.message)
+        elif event.type in ("response.completed", "response.failed", "response.incomplete"):
+            check_response(event.response)
+
+def process_followup(messages):
+    # Yield the follow-up answer as it is generated; the request is only sent once
+    # the first chunk is asked for
+    response = client.chat.completions.create(
+        model="gpt-4.1",
+        messages=messages,
+        max_tokens=FOLLOWUP_MAX_TOKENS,
+        stream=True,
+    )
+    for chunk in response:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+def write_stream(chunks, waiting_text):
+    # Show a spinner only until the first chunk arrives, then render the rest as
+    # it streams in
+    chunks = iter(chunks)
+    with st.spinner(waiting_text):
+        first = next(chunks, "")
+    chunks = chain([first], chunks)
+    # Backward compatibility: st.write_stream was added in Streamlit 1.31
+    if hasattr(st, "write_stream"):
+        return st.write_stream(chunks)
+    text = "".join(chunks)
+    st.markdown(text)
+    return text
+
+def generate_assessment(images, supplies, setting, expertise, willingness, frequency, infected, moisture):
+    # Identical (images, inputs) submissions are served from the cache; new ones are
+    # streamed to the page as they arrive. Errors propagate so they are never cached
+    inputs = (supplies, setting, expertise, willingness, frequency, infected, moisture)
+    key = ("assessment", tuple(image_digest(image_bytes) for image_bytes in images)) + inputs
+    assessment = cached_response(key)
+    if assessment is not None:
+        st.markdown(assessment)
+        return assessment
+
+    waiting_text = "Analyzing image..." if len(images) == 1 else "Analyzing images..."
+    assessment = write_stream(process_image(images, *inputs), waiting_text)
+    if not assessment:
+        raise RuntimeError("The model returned an empty assessment")
+    cache_response(key, assessment)
+    return assessment
+
+async def assess_images(requests, on_result):
+    # Run the (index, cache key, model input) requests concurrently, at most
+    # BATCH_MAX_CONCURRENCY at a time, calling on_result(index, text, error) as
+    # each one finishes. A failed request only loses its own image, and its error
+    # is never cached. The async client is created per batch because its
+    # connection pool is bound to the event loop asyncio.run creates
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    async with AsyncOpenAI(api_key=api_key, timeout=API_TIMEOUT, max_retries=API_MAX_RETRIES) as aclient:
+        async def assess(index, key, messages):
+            try:
+                async with semaphore:
+                    response = await aclient.responses.create(
+                        model="gpt-4.1",
+                        input=messages,
+                        max_output_tokens=ASSESSMENT_MAX_OUTPUT_TOKENS
+                    )
+                assessment = check_response(response)
+            except Exception as e:
+                return index, None, e
+            cache_response(key, assessment)
+            return index, assessment, None
+        for completed in asyncio.as_completed([assess(*request) for request in requests]):
+            on_result(*await completed)
+
+def generate_batch_assessment(images, supplies, setting, expertise, willingness, frequency, infected, moisture):
+    # Used when there are too many images for one request. Each image is assessed
+    # independently; cached ones are reused and the rest are sent concurrently so
+    # N images take about as long as one
+    inputs = (supplies, setting, expertise, willingness, frequency, infected, moisture)
+    keys = [("assessment", (image_digest(image_bytes),)) + inputs for image_bytes in images]
+    results = [cached_response(key) for key in keys]
+
+    # One placeholder per image, filled in as soon as its assessment completes
+    placeholders = [st.empty() for _ in images]
+    def show_result(i, result, error=None):
+        if error is not None:
+            result = f"⚠️ Error calling OpenAI API: {error}"
+            placeholders[i].error(f"Image {i + 1}: {result}")
+        else:
+            placeholders[i].markdown(f"### Image {i + 1}\n\n{result}")
+        results[i] = result
+
+    pending = []
+    for i, result in enumerate(results):
+        if result is None:
+            placeholders[i].info(f"Analyzing image {i + 1}...")
+            pending.append(i)
+        else:
+            show_result(i, result)
+    if pending:
+        requests = []
+        for i in pending:
+            try:
+                requests.append((i, keys[i], build_assessment_input([images[i]], *inputs)))
+            except Exception as e:
+                show_result(i, None, e)
+        asyncio.run(assess_images(requests, show_result))
+    return "\n\n".join(f"### Image {i}\n\n{result}" for i, result in enumerate(results, 1))
+
+# Initialize session state for page navigation
+if 'current_page' not in st.session_state:
+    st.session_state.current_page = "input"  # "input" or "results"
+if 'assessment_data' not in st.session_state:
+    st.session_state.assessment_data = None
+
+# Backward compatibility: st.fragment was st.experimental_fragment before Streamlit 1.37,
+# and older versions without either simply run fragments inline
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+# Rerun only the enclosing fragment where supported, otherwise the whole script
+rerun_fragment = partial(st.rerun, scope="fragment") if hasattr(st, "fragment") else rerun
+
+def show_image(image, caption):
+    # Display an image in a version-compatible way; newer Streamlit replaced
+    # use_column_width with width='stretch'
+    try:
+        st.image(image, caption=caption, width='stretch')
+    except TypeError:
+        st.image(image, caption=caption, use_column_width=True)
+
+@fragment
+def image_uploader():
+    # File uploader for images; several images are assessed as a batch
+    uploaded_files = st.file_uploader(
+        "Choose one or more wound images...",
+        type=["jpg", "jpeg", "png"],
+        accept_multiple_files=True,
+        key="uploaded_images"
+    )
+    for uploaded_file in uploaded_files or []:
+        # Refuse oversized photos before any decode, base64 or upload work is done
+        if uploaded_file.size > MAX_UPLOAD_BYTES:
+            st.error(f"{uploaded_file.name} is too large; please upload images under {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+        else:
+            start_preprocessing(uploaded_file)
+    forget_removed_uploads(uploaded_files or [])
+
+@fragment
+def followup_ui(assessment):
+    # Follow-up question UI - Multi-turn conversation
+    st.markdown("---")
+    st.markdown("### Follow-up")
+    
+    # Initialize session state for conversation history
+    if 'conversation_history' not in st.session_state:
+        st.session_state.conversation_history = []
+    if 'continue_conversation' not in st.session_state:
+        st.session_state.continue_conversation = True
+    
+    # Display conversation history
+    if st.session_state.conversation_history:
+        st.markdown("#### Conversation:")
+        for i, exchange in enumerate(st.session_state.conversation_history):
+            st.markdown(f"**Q{i+1}:** {exchange['question']}")
+            st.markdown(f"**A{i+1}:** {exchange['answer']}")
+            st.markdown("---")
+    
+    # Show follow-up UI if conversation is active
+    if st.session_state.continue_conversation:
+        st.write("Do you have any additional questions?")
+        
+        followup_choice = st.radio(
+            "Would you like to ask a question?",
+            ["Yes", "No"],
+            key="followup_choice"
+        )
+        
+        if followup_choice == "No":
+            if st.button("Finish", key="finish_conversation"):
+                st.session_state.continue_conversation = False
+                delete_uploaded_images()
+                st.success("Thank you for using the wound assistant.")
+                rerun_fragment()
+        else:
+            followup_question = st.text_area(
+                "Please enter your question or clarification:",
+                key="followup_question"
+            )
+            
+            if st.button("Ask", key="ask_followup"):
+                if not followup_question or not followup_question.strip():
+                    st.warning("Please enter a question before asking.")
+                else:
+                    try:
+                        # Build context from conversation history
+                        context = f"Original assessment:\n\n{assessment}\n\n"
+                        if st.session_state.conversation_history:
+                            context += "Previous conversation:\n"
+                            for i, exchange in enumerate(st.session_state.conversation_history):
+                                context += f"Q{i+1}: {exchange['question']}\n"
+                                context += f"A{i+1}: {exchange['answer']}\n\n"
+                        
+                        follow_messages = [
+                            {
+                                "role": "user",
+                                "content": (
+                                    f"{context}"
+                                    f"Current question: {followup_question}\n\n"
+                                    "Please answer the question clearly, referencing the assessment and previous conversation where helpful. "
+                                    "Be concise and actionable. Make answer only paragraph long maximum. With no em dashes or hyphens."
+                                ),
+                            }
+                        ]
+                        
+                        # The prompt holds the assessment and the whole conversation,
+                        # so its digest identifies a repeated question exactly
+                        cache_key = ("followup", hashlib.blake2b(follow_messages[0]["content"].encode("utf-8"), digest_size=16).digest())
+                        response_text = cached_response(cache_key)
+                        if response_text is None:
+                            # Render the answer as it streams in
+                            response_text = write_stream(process_followup(follow_messages), "Getting assistant response...")
+                            cache_response(cache_key, response_text)
+                        
+                        # Add to conversation history
+                        st.session_state.conversation_history.append({
+                            'question': followup_question,
+                            'answer': response_text
+                        })
+                        
+                        # Clear the question box (its key is reused every turn) and
+                        # rerun the fragment to show updated conversation
+                        del st.session_state["followup_question"]
+                        rerun_fragment()
+                            
+                    except Exception as e:
+                        st.error(f"⚠️ Error calling OpenAI API: {e}")
+    else:
+        st.success("Thank you for using the wound assistant.")
+
 # PAGE ROUTING: Show input page or results page
 if st.session_state.current_page == "input":
     # ==================== INPUT PAGE ====================
@@ -168,147 +670,137 @@ if st.session_state.current_page == "input":
     st.markdown("""
     ### Instructions:
 
-    1. Fill out all the questions
-    2. Upload a clear, well-lit photo of the wound
+    1. Upload a clear, well-lit photo of the wound
+    2. Fill out all the questions
     3. Click "Generate Assessment" to get a personalized wound care plan
 
     """)
     st.markdown("---")
 
-    # Create single column for input
-    st.markdown("## Input Parameters")
+    # The uploader sits outside the form in its own fragment, so a new upload only
+    # reruns the uploader while preprocessing starts in the background
+    image_uploader()
+    uploaded_files = st.session_state.get("uploaded_images")
     st.markdown("---")
+
+    # Collect all inputs in a form so widget edits don't rerun the script until submit
+    with st.form("assessment_form", clear_on_submit=False):
+        # Create single column for input
+        st.markdown("## Input Parameters")
+        st.markdown("---")
     
-    # Supply options with checkboxes
-    st.markdown("### 1. Available Supplies")
-    st.markdown("*Select all that apply:*")
-    supply_options = [
-        "BandAid",
-        "Bandage",
-        "Fabric or elastic bandages",
-        "Sterile gauze pads",
-        "Sterile gauze rolls",
-        "Non-stick wound pads",
-        "Adhesive wound dressings",
-        "Transparent film dressings",
-        "Medical adhesive tape",
-        "Sterile saline solution",
-        "Antiseptic wipes",
-        "Antibacterial or antibiotic ointment",
-        "Barrier cream or ointment",
-        "Disposable gloves",
-        "Other"
-    ]
-    supplies = []
-    for option in supply_options:
-        checked = st.checkbox(option, key=f"supply_{option}")
-        if checked:
-            if option == "Other":
-                other_supplies = st.text_input("Please specify other supplies:", key="other_supplies_input")
-                if other_supplies:
-                    supplies.append(f"Other: {other_supplies}")
-            else:
-                supplies.append(option)
-    st.markdown("---")
+        # Supply options in a single multiselect
+        st.markdown("### 1. Available Supplies")
+        supply_options = [
+            "BandAid",
+            "Bandage",
+            "Fabric or elastic bandages",
+            "Sterile gauze pads",
+            "Sterile gauze rolls",
+            "Non-stick wound pads",
+            "Adhesive wound dressings",
+            "Transparent film dressings",
+            "Medical adhesive tape",
+            "Sterile saline solution",
+            "Antiseptic wipes",
+            "Antibacterial or antibiotic ointment",
+            "Barrier cream or ointment",
+            "Disposable gloves",
+            "Other"
+        ]
+        selected_supplies = st.multiselect("*Select all that apply:*", supply_options, default=[], key="supplies")
+        supplies = [option for option in selected_supplies if option != "Other"]
+        # Widgets inside a form don't rerun until submit, so the "Other" boxes are always shown
+        other_supplies = st.text_input("If Other, please specify other supplies:", key="other_supplies_input")
+        if "Other" in selected_supplies and other_supplies:
+            supplies.append(f"Other: {other_supplies}")
+        st.markdown("---")
 
-    # Other input fields
-    st.markdown("### 2. Care Setting")
-    setting = st.selectbox(
-        "*Where is the care being provided?*",
-        ["Harm reduction clinic", "Outpatient clinic", "Home", "Other"]
-    )
-    # If the user selects Other, show a text box to capture the custom setting
-    if setting == "Other":
-        other_setting = st.text_input("Please specify care setting:", key="other_setting_input")
-        if other_setting:
+        # Other input fields
+        st.markdown("### 2. Care Setting")
+        setting = st.selectbox(
+            "*Where is the care being provided?*",
+            ["Harm reduction clinic", "Outpatient clinic", "Home", "Other"]
+        )
+        # If the user selects Other, the text box captures the custom setting
+        other_setting = st.text_input("If Other, please specify care setting:", key="other_setting_input")
+        if setting == "Other" and other_setting:
             setting = f"Other: {other_setting}"
-    st.markdown("---")
+        st.markdown("---")
 
-    st.markdown("### 3. Provider Expertise")
-    expertise = st.selectbox(
-        "*What is your level of experience with wounds?*",
-        [
-            "Healthcare professional with wound care experience",
-            "Healthcare professional without wound care experience",
-            "Non-healthcare professional"
-        ]
-    )
-    st.markdown("---")
+        st.markdown("### 3. Provider Expertise")
+        expertise = st.selectbox(
+            "*What is your level of experience with wounds?*",
+            [
+                "Healthcare professional with wound care experience",
+                "Healthcare professional without wound care experience",
+                "Non-healthcare professional"
+            ]
+        )
+        st.markdown("---")
 
-    st.markdown("### 4. Hospital Access")
-    willingness = st.radio(
-        "*Is the individual willing to go to hospital if needed?*",
-        ["Yes", "No"]
-    )
-    st.markdown("---")
+        st.markdown("### 4. Hospital Access")
+        willingness = st.radio(
+            "*Is the individual willing to go to hospital if needed?*",
+            ["Yes", "No"]
+        )
+        st.markdown("---")
 
-    st.markdown("### 5. Clinic Visits")
-    frequency = st.selectbox(
-        "*How often can the individual visit the clinic?*",
-        ["Daily", "Weekly", "Other"]
-    )
-    if frequency == "Other":
-        other_frequency = st.text_input("Please specify visit frequency:", key="other_frequency_input")
-        if other_frequency:
+        st.markdown("### 5. Clinic Visits")
+        frequency = st.selectbox(
+            "*How often can the individual visit the clinic?*",
+            ["Daily", "Weekly", "Other"]
+        )
+        other_frequency = st.text_input("If Other, please specify visit frequency:", key="other_frequency_input")
+        if frequency == "Other" and other_frequency:
             frequency = f"Other: {other_frequency}"
-    st.markdown("---")
+        st.markdown("---")
 
-    st.markdown("### 6. Infection Status")
-    infected = st.radio(
-        "*Does the wound show signs of infection?*",
-        ["Yes", "No", "Not sure"]
-    )
-    st.markdown("---")
+        st.markdown("### 6. Infection Status")
+        infected = st.radio(
+            "*Does the wound show signs of infection?*",
+            ["Yes", "No", "Not sure"]
+        )
+        st.markdown("---")
 
-    st.markdown("### 7. Moisture Level")
-    moisture = st.radio(
-        "*What is the wound's moisture condition?*",
-        ["Dry", "Wet", "Normal", "Mix of dry and wet"]
-    )
-    st.markdown("---")
+        st.markdown("### 7. Moisture Level")
+        moisture = st.radio(
+            "*What is the wound's moisture condition?*",
+            ["Dry", "Wet", "Normal", "Mix of dry and wet"]
+        )
+        st.markdown("---")
 
-    # File uploader for image
-    uploaded_file = st.file_uploader("Choose a wound image...", type=["jpg", "jpeg", "png"])
+        # Submit button
+        submitted = st.form_submit_button("Generate Assessment", type="primary", use_container_width=True)
 
-    # Submit button
-    if st.button("Generate Assessment", type="primary", use_container_width=True):
-        if uploaded_file is None:
+    if submitted:
+        if not uploaded_files:
             st.error("Please upload an image first.")
+        elif any(uploaded_file.size > MAX_UPLOAD_BYTES for uploaded_file in uploaded_files):
+            st.error(f"Please remove images over {MAX_UPLOAD_BYTES // (1024 * 1024)} MB before generating an assessment.")
         elif not supplies:
             st.error("Please select at least one available supply.")
         else:
-            # Store data and switch to results page
-            with st.spinner("Analyzing image..."):
-                assessment = process_image(
-                    uploaded_file,
-                    supplies,
-                    setting,
-                    expertise,
-                    willingness,
-                    frequency,
-                    infected,
-                    moisture
-                )
-                st.session_state.assessment_data = {
-                    'assessment': assessment,
-                    'image': uploaded_file,
-                    'supplies': supplies,
-                    'setting': setting,
-                    'expertise': expertise,
-                    'willingness': willingness,
-                    'frequency': frequency,
-                    'infected': infected,
-                    'moisture': moisture
-                }
-                st.session_state.current_page = "results"
-                # Reset follow-up state for new assessment
-                st.session_state.conversation_history = []
-                st.session_state.continue_conversation = True
-                # Use compatible rerun
-                if hasattr(st, "rerun"):
-                    st.rerun()
-                else:
-                    st.experimental_rerun()
+            # Store data and switch to results page; the assessment itself is
+            # streamed there so the user sees text as soon as it is generated.
+            # The image bytes are read once here and reused on every later rerun
+            st.session_state.assessment_data = {
+                'assessment': None,
+                'images': [uploaded_image_bytes(uploaded_file) for uploaded_file in uploaded_files],
+                'image_names': [uploaded_file.name for uploaded_file in uploaded_files],
+                'supplies': supplies,
+                'setting': setting,
+                'expertise': expertise,
+                'willingness': willingness,
+                'frequency': frequency,
+                'infected': infected,
+                'moisture': moisture
+            }
+            st.session_state.current_page = "results"
+            # Reset follow-up state for new assessment
+            st.session_state.conversation_history = []
+            st.session_state.continue_conversation = True
+            rerun()
 
 elif st.session_state.current_page == "results":
     # ==================== RESULTS PAGE ====================
@@ -319,10 +811,7 @@ elif st.session_state.current_page == "results":
     with col1:
         if st.button("← Back to Input", type="secondary"):
             st.session_state.current_page = "input"
-            if hasattr(st, "rerun"):
-                st.rerun()
-            else:
-                st.experimental_rerun()
+            rerun()
     
     st.markdown("---")
     
@@ -340,108 +829,40 @@ elif st.session_state.current_page == "results":
     
     # Display uploaded image
     if st.session_state.assessment_data:
-        uploaded_file = st.session_state.assessment_data['image']
+        images = st.session_state.assessment_data['images']
         assessment = st.session_state.assessment_data['assessment']
         
-        # Display image in a version-compatible way
-        try:
-            st.image(uploaded_file, caption="Uploaded Image", width='stretch')
-        except TypeError:
-            st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
+        # Display images in a version-compatible way
+        for i, image_bytes in enumerate(images, 1):
+            caption = "Uploaded Image" if len(images) == 1 else f"Image {i}"
+            show_image(image_bytes, caption)
         
         st.markdown("---")
         st.markdown("## Assessment")
-        st.markdown(assessment)
-
-        # Follow-up question UI - Multi-turn conversation
-        st.markdown("---")
-        st.markdown("### Follow-up")
-        
-        # Initialize session state for conversation history
-        if 'conversation_history' not in st.session_state:
-            st.session_state.conversation_history = []
-        if 'continue_conversation' not in st.session_state:
-            st.session_state.continue_conversation = True
-        
-        # Display conversation history
-        if st.session_state.conversation_history:
-            st.markdown("#### Conversation:")
-            for i, exchange in enumerate(st.session_state.conversation_history):
-                st.markdown(f"**Q{i+1}:** {exchange['question']}")
-                st.markdown(f"**A{i+1}:** {exchange['answer']}")
-                st.markdown("---")
-        
-        # Show follow-up UI if conversation is active
-        if st.session_state.continue_conversation:
-            st.write("Do you have any additional questions?")
-            
-            followup_choice = st.radio(
-                "Would you like to ask a question?",
-                ["Yes", "No"],
-                key=f"followup_choice_{len(st.session_state.conversation_history)}"
+        if assessment is None:
+            data = st.session_state.assessment_data
+            inputs = (
+                tuple(sorted(data['supplies'])),
+                data['setting'],
+                data['expertise'],
+                data['willingness'],
+                data['frequency'],
+                data['infected'],
+                data['moisture']
             )
-            
-            if followup_choice == "No":
-                if st.button("Finish", key="finish_conversation"):
-                    st.session_state.continue_conversation = False
-                    st.success("Thank you for using the wound assistant.")
-                    if hasattr(st, "rerun"):
-                        st.rerun()
-                    else:
-                        st.experimental_rerun()
-            else:
-                followup_question = st.text_area(
-                    "Please enter your question or clarification:",
-                    key=f"followup_question_{len(st.session_state.conversation_history)}"
-                )
-                
-                if st.button("Ask", key=f"ask_followup_{len(st.session_state.conversation_history)}"):
-                    if not followup_question or not followup_question.strip():
-                        st.warning("Please enter a question before asking.")
-                    else:
-                        with st.spinner("Getting assistant response..."):
-                            try:
-                                # Build context from conversation history
-                                context = f"Original assessment:\n\n{assessment}\n\n"
-                                if st.session_state.conversation_history:
-                                    context += "Previous conversation:\n"
-                                    for i, exchange in enumerate(st.session_state.conversation_history):
-                                        context += f"Q{i+1}: {exchange['question']}\n"
-                                        context += f"A{i+1}: {exchange['answer']}\n\n"
-                                
-                                follow_messages = [
-                                    {
-                                        "role": "user",
-                                        "content": (
-                                            f"{context}"
-                                            f"Current question: {followup_question}\n\n"
-                                            "Please answer the question clearly, referencing the assessment and previous conversation where helpful. "
-                                            "Be concise and actionable. Make answer only paragraph long maximum. With no em dashes or hyphens."
-                                        ),
-                                    }
-                                ]
-                                
-                                follow_resp = client.chat.completions.create(
-                                    model="gpt-4.1",
-                                    messages=follow_messages,
-                                    max_tokens=500,
-                                )
-                                
-                                response_text = follow_resp.choices[0].message.content
-                                
-                                # Add to conversation history
-                                st.session_state.conversation_history.append({
-                                    'question': followup_question,
-                                    'answer': response_text
-                                })
-                                
-                                # Rerun to show updated conversation
-                                if hasattr(st, "rerun"):
-                                    st.rerun()
-                                else:
-                                    st.experimental_rerun()
-                                    
-                            except Exception as e:
-                                st.error(f"⚠️ Error calling OpenAI API: {e}")
+            try:
+                # Up to IMAGES_PER_REQUEST images go out in one streamed request;
+                # larger batches are split into concurrent per-image requests
+                if len(images) <= IMAGES_PER_REQUEST:
+                    assessment = generate_assessment(images, *inputs)
+                else:
+                    assessment = generate_batch_assessment(images, *inputs)
+            except Exception as e:
+                assessment = f"⚠️ Error calling OpenAI API: {e}"
+                st.markdown(assessment)
+            data['assessment'] = assessment
         else:
-            st.success("Thank you for using the wound assistant.")
\ No newline at end of file
+            st.markdown(assessment)
+
+        # Follow-up Q&A reruns on its own without re-executing the whole page
+        followup_ui(assessment)